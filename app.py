@@ -1,10 +1,116 @@
 import streamlit as st
-from openai import OpenAI
+from openai import (AsyncOpenAI, DefaultAsyncHttpxClient, APIConnectionError,
+                    APITimeoutError, AuthenticationError, BadRequestError,
+                    InternalServerError, OpenAIError, RateLimitError)
+import httpx
+from aiolimiter import AsyncLimiter
+import aiosqlite
+import asyncio
+import csv
+import diskcache
+from collections import ChainMap, OrderedDict
+from contextlib import asynccontextmanager
+import hashlib
+import io
 import json
+import logging
+import pandas as pd
+import math
+import numpy as np
 import re
-from typing import List, Dict, Any
+import sqlite3
+import threading
+import tiktoken
+from tenacity import retry, retry_if_exception, stop_after_attempt, wait_random_exponential
+from types import MappingProxyType
+from typing import List, Dict, Any, Final, Mapping, Optional, Tuple
 import time
 
+logger = logging.getLogger(__name__)
+
+try:
+    import re2 as phrase_re  # linear-time automaton matcher when google-re2 is installed
+except ImportError:
+    phrase_re = re
+
+try:
+    import uvloop  # faster task scheduling for the background event loop
+except ImportError:  # not available on Windows
+    uvloop = None
+
+# Concurrency, pacing and retry limits for OpenAI requests
+MAX_CONCURRENT_REQUESTS = 8
+REQUESTS_PER_MINUTE = 500
+# Token quota, charged per request as its prompt estimate plus the full
+# completion budget, which is how OpenAI counts it against the limit
+TOKENS_PER_MINUTE = 200_000
+CHARS_PER_TOKEN = 4
+MAX_REQUEST_ATTEMPTS = 6
+RETRYABLE_ERRORS = (RateLimitError, APITimeoutError, APIConnectionError, InternalServerError)
+# After a bad key or an exhausted quota, further calls fail locally for this
+# long instead of each spending a round-trip on the same error
+ACCOUNT_ERROR_COOLDOWN_SECONDS = 60
+
+# Identical requests are answered from an in-process LRU of this size, backed
+# by an on-disk cache that survives restarts for a day
+RESPONSE_CACHE_SIZE = 128
+RESPONSE_CACHE_DIR = ".openai_cache"
+RESPONSE_CACHE_TTL_SECONDS = 24 * 3600
+
+# Near-duplicate prompts for the same business reuse a stored completion when
+# their embeddings are at least this similar
+SEMANTIC_CACHE_PATH = "semantic_cache.db"
+SEMANTIC_CACHE_THRESHOLD = 0.95
+SEMANTIC_CACHE_TTL_SECONDS = 7 * 24 * 3600
+EMBEDDING_MODEL = "text-embedding-3-small"
+
+# HTTP connection pool shared by all requests from one generator
+HTTP_MAX_CONNECTIONS = 20
+HTTP_KEEPALIVE_SECONDS = 60
+# Fail fast on an unreachable host, but leave generous room between streamed
+# chunks and for long non-streaming completions
+HTTP_CONNECT_TIMEOUT_SECONDS = 5.0
+HTTP_TIMEOUT_SECONDS = 60.0
+
+# Completions requested per Quick Generate call; extras back "Regenerate"
+VARIANTS_PER_REQUEST = 3
+
+# Batch API statuses after which OpenAI does no more work on a job
+BATCH_TERMINAL_STATUSES = ("completed", "failed", "expired", "cancelled")
+# Failed batch rows listed by name before the rest are summarised as a count
+BATCH_FAILURES_SHOWN = 10
+
+# Token budgeting - completions are sized from the requested word count
+DEFAULT_MAX_TOKENS = 2000
+TOKENS_PER_WORD = 1.5
+MAX_TOKENS_MARGIN = 200
+# A template section may run to this multiple of its even share of the page
+SECTION_BUDGET_SLACK = 3
+
+# Model routing - the sidebar quality tier picks the model, and long jobs on
+# the Fast tier are escalated to the Balanced model. "Auto" lets each tab use
+# its own default tier.
+MODEL_TIERS = {
+    "Fast": "gpt-4o-mini",
+    "Balanced": "gpt-4o",
+    "Premium": "gpt-4-turbo"
+}
+AUTO_TIER = "Auto"
+DEFAULT_MODEL = MODEL_TIERS["Fast"]
+LONG_JOB_WORDS = 800
+MODEL_CONTEXT_WINDOWS = {
+    "gpt-4o-mini": 128000,
+    "gpt-4o": 128000,
+    "gpt-4-turbo": 128000,
+    "gpt-4": 8192
+}
+
+# History lives in SQLite and is read one page at a time, so memory and render
+# cost stay flat however much accumulates
+HISTORY_PAGE_SIZE = 50
+HISTORY_PREVIEW_CHARS = 200
+HISTORY_DB_PATH = "history.db"
+
 # Configure page
 st.set_page_config(
     page_title="Professional Content Generator",
@@ -13,34 +119,13 @@ st.set_page_config(
 )
 
 # Initialize session state
-if 'generated_content' not in st.session_state:
-    st.session_state.generated_content = ""
-if 'content_history' not in st.session_state:
-    st.session_state.content_history = []
+st.session_state.setdefault('generated_content', "")
+st.session_state.setdefault('variants', [])
+st.session_state.setdefault('variant_idx', 0)
+st.session_state.setdefault('variant_prompt', None)
+st.session_state.setdefault('variant_model', DEFAULT_MODEL)
 
-class ContentGenerator:
-    def __init__(self, api_key: str):
-        self.client = OpenAI(api_key=api_key)
-        
-    def generate_content(self, prompt: str, max_tokens: int = 2000) -> str:
-        """Generate content using OpenAI API"""
-        try:
-            response = self.client.chat.completions.create(
-                model="gpt-4",
-                messages=[
-                    {"role": "system", "content": self.get_system_prompt()},
-                    {"role": "user", "content": prompt}
-                ],
-                max_tokens=max_tokens,
-                temperature=0.7
-            )
-            return response.choices[0].message.content
-        except Exception as e:
-            st.error(f"Error generating content: {str(e)}")
-            return ""
-    
-    def get_system_prompt(self) -> str:
-        return """You are a professional content writer specializing in creating engaging, human-like content for websites. Your writing should be:
+_SYSTEM_PROMPT: Final[str] = """You are a professional content writer specializing in creating engaging, human-like content for websites. Your writing should be:
 
 1. Professional yet conversational
 2. Engaging and compelling
@@ -67,91 +152,191 @@ Instead, use:
 - Industry-specific terminology
 - Customer-focused messaging"""
 
-def create_template_prompt(template_sections: List[Dict], business_info: Dict, 
-                          keywords: List[str], word_count: int = None, 
-                          custom_requirements: str = None) -> str:
-    """Create a prompt based on the template structure"""
-    
-    # Build section descriptions
-    section_descriptions = {
-        "H1": "Create a compelling, attention-grabbing headline that immediately communicates the main value proposition",
-        "Intro": "Write 1-2 engaging paragraphs that hook the reader and frame the topic or service",
-        "Sub-H2": "Create a secondary header that introduces the next section of content",
-        "Body-Copy": "Write informative paragraph(s) that provide detailed information under the preceding header",
-        "Bullet-List": "Create a bulleted list of benefits, features, symptoms, or key points (3-6 items)",
-        "Quote-Testimonial": "Write a 20-40 word testimonial quote with customer name and relevant details",
-        "FAQ-Pair": "Create a frequently asked question with a 2-3 sentence informative answer",
-        "CTA": "Write a compelling call-to-action with clear next steps and action-oriented language",
-        "Closing": "Create a reassuring closing statement that encourages the next step",
-        "Service-Overview": "Provide a comprehensive overview of the service or product offering",
-        "Benefits-Section": "Detail the key advantages and value propositions for customers",
-        "Process-Steps": "Explain the step-by-step process or methodology in clear, actionable steps",
-        "Team-Bio": "Highlight team credentials, expertise, and what makes them qualified",
-        "Pricing-Info": "Present pricing information or consultation details in a clear, accessible way",
-        "Contact-Info": "Provide clear contact information including location, hours, and contact methods"
-    }
-    
-    prompt = f"""Create professional web content for {business_info['business_name']}, a {business_info['industry']} business.
+# Template Builder catalogue - read-only so sessions can share it. Streamlit
+# re-executes this script on every rerun, so these literals are rebuilt each
+# time; at a few dozen small dicts that costs microseconds, far less than any
+# file load would
 
-Business Details:
-- Name: {business_info['business_name']}
-- Industry: {business_info['industry']}
-- Target Audience: {business_info.get('target_audience', 'General consumers')}
+# What each section type should contain, for the model
+_SECTION_DESCRIPTIONS: Mapping[str, str] = MappingProxyType({
+    "H1": "Create a compelling, attention-grabbing headline that immediately communicates the main value proposition",
+    "Intro": "Write 1-2 engaging paragraphs that hook the reader and frame the topic or service",
+    "Sub-H2": "Create a secondary header that introduces the next section of content",
+    "Body-Copy": "Write informative paragraph(s) that provide detailed information under the preceding header",
+    "Bullet-List": "Create a bulleted list of benefits, features, symptoms, or key points (3-6 items)",
+    "Quote-Testimonial": "Write a 20-40 word testimonial quote with customer name and relevant details",
+    "FAQ-Pair": "Create a frequently asked question with a 2-3 sentence informative answer",
+    "CTA": "Write a compelling call-to-action with clear next steps and action-oriented language",
+    "Closing": "Create a reassuring closing statement that encourages the next step",
+    "Service-Overview": "Provide a comprehensive overview of the service or product offering",
+    "Benefits-Section": "Detail the key advantages and value propositions for customers",
+    "Process-Steps": "Explain the step-by-step process or methodology in clear, actionable steps",
+    "Team-Bio": "Highlight team credentials, expertise, and what makes them qualified",
+    "Pricing-Info": "Present pricing information or consultation details in a clear, accessible way",
+    "Contact-Info": "Provide clear contact information including location, hours, and contact methods"
+})
 
-CONTENT STRUCTURE - Create content in this exact order:
-"""
-    
-    for i, section in enumerate(template_sections):
-        section_type = section['type']
-        section_name = section['name']
-        
-        prompt += f"\n{i+1}. **{section_name.upper()}**\n"
-        prompt += f"   {section_descriptions.get(section_type, 'Create appropriate content for this section.')}\n"
-    
-    # Add keyword requirements
-    if keywords:
-        keyword_text = ", ".join(keywords)
-        prompt += f"\n\nSEO KEYWORDS to integrate naturally: {keyword_text}"
-        prompt += "\nDistribute these keywords naturally throughout the content sections."
-    
-    # Add word count
-    if word_count:
-        prompt += f"\n\nTARGET WORD COUNT: Write approximately {word_count} WORDS total (not characters). This means roughly {word_count // 6} to {word_count // 4} sentences depending on sentence length."
-    
-    # Add custom requirements
-    if custom_requirements:
-        prompt += f"\n\nCUSTOM REQUIREMENTS: {custom_requirements}"
-    
-    prompt += """
+# Section buttons shown in the builder
+_SECTION_DEFINITIONS: Mapping[str, Dict[str, str]] = MappingProxyType({
+    "H1": {
+        "name": "H1 - Main Headline",
+        "description": "Main page headline (1 only)",
+        "icon": "🎯"
+    },
+    "Intro": {
+        "name": "Intro Paragraph",
+        "description": "1–2-paragraph hook that frames the topic or service",
+        "icon": "📝"
+    },
+    "Sub-H2": {
+        "name": "Sub-H2 Header",
+        "description": "Secondary header to split body content",
+        "icon": "📑"
+    },
+    "Body-Copy": {
+        "name": "Body Copy",
+        "description": "Paragraph(s) under a Sub-H2",
+        "icon": "📄"
+    },
+    "Bullet-List": {
+        "name": "Bullet List",
+        "description": "Benefits, symptoms, checklist, features, etc.",
+        "icon": "🔸"
+    },
+    "Quote-Testimonial": {
+        "name": "Quote/Testimonial",
+        "description": "20-40 words with customer name and title",
+        "icon": "💬"
+    },
+    "FAQ-Pair": {
+        "name": "FAQ Pair",
+        "description": "Question + 2-3-sentence answer",
+        "icon": "❓"
+    },
+    "CTA": {
+        "name": "Call to Action",
+        "description": "1-sentence prompt + button label/URL",
+        "icon": "🚀"
+    },
+    "Closing": {
+        "name": "Closing Statement",
+        "description": "Reassurance/next-step line (often before footer)",
+        "icon": "✅"
+    },
+    "Service-Overview": {
+        "name": "Service Overview",
+        "description": "Detailed explanation of service/product",
+        "icon": "🛠️"
+    },
+    "Benefits-Section": {
+        "name": "Benefits Section",
+        "description": "Key advantages and value propositions",
+        "icon": "⭐"
+    },
+    "Process-Steps": {
+        "name": "Process/How It Works",
+        "description": "Step-by-step process or methodology",
+        "icon": "🔄"
+    },
+    "Team-Bio": {
+        "name": "Team/About Section",
+        "description": "Staff credentials and expertise",
+        "icon": "👥"
+    },
+    "Pricing-Info": {
+        "name": "Pricing Information",
+        "description": "Cost details or consultation info",
+        "icon": "💰"
+    },
+    "Contact-Info": {
+        "name": "Contact Information",
+        "description": "Location, hours, contact details",
+        "icon": "📞"
+    }
+})
+
+# Ready-made page structures; the tuples keep a preset's section order fixed
+_PRESET_TEMPLATES: Mapping[str, Tuple[Dict[str, str], ...]] = MappingProxyType({
+    "Standard Service Page": (
+        {'type': 'H1', 'name': 'H1 - Main Headline', 'description': 'Main page headline', 'icon': '🎯'},
+        {'type': 'Intro', 'name': 'Intro Paragraph', 'description': 'Hook that frames the service', 'icon': '📝'},
+        {'type': 'Service-Overview', 'name': 'Service Overview', 'description': 'Detailed service explanation', 'icon': '🛠️'},
+        {'type': 'Benefits-Section', 'name': 'Benefits Section', 'description': 'Key advantages', 'icon': '⭐'},
+        {'type': 'Process-Steps', 'name': 'Process/How It Works', 'description': 'Step-by-step process', 'icon': '🔄'},
+        {'type': 'Quote-Testimonial', 'name': 'Quote/Testimonial', 'description': 'Customer testimonial', 'icon': '💬'},
+        {'type': 'FAQ-Pair', 'name': 'FAQ Pair', 'description': 'Common questions', 'icon': '❓'},
+        {'type': 'CTA', 'name': 'Call to Action', 'description': 'Conversion prompt', 'icon': '🚀'},
+        {'type': 'Closing', 'name': 'Closing Statement', 'description': 'Final reassurance', 'icon': '✅'}
+    ),
+    "Simple Landing Page": (
+        {'type': 'H1', 'name': 'H1 - Main Headline', 'description': 'Main page headline', 'icon': '🎯'},
+        {'type': 'Intro', 'name': 'Intro Paragraph', 'description': 'Compelling hook', 'icon': '📝'},
+        {'type': 'Benefits-Section', 'name': 'Benefits Section', 'description': 'Key benefits', 'icon': '⭐'},
+        {'type': 'Quote-Testimonial', 'name': 'Quote/Testimonial', 'description': 'Social proof', 'icon': '💬'},
+        {'type': 'CTA', 'name': 'Call to Action', 'description': 'Primary conversion', 'icon': '🚀'}
+    ),
+    "Blog Post Structure": (
+        {'type': 'H1', 'name': 'H1 - Main Headline', 'description': 'Article title', 'icon': '🎯'},
+        {'type': 'Intro', 'name': 'Intro Paragraph', 'description': 'Article introduction', 'icon': '📝'},
+        {'type': 'Sub-H2', 'name': 'Sub-H2 Header', 'description': 'Section header', 'icon': '📑'},
+        {'type': 'Body-Copy', 'name': 'Body Copy', 'description': 'Main content', 'icon': '📄'},
+        {'type': 'Bullet-List', 'name': 'Bullet List', 'description': 'Key points', 'icon': '🔸'},
+        {'type': 'Sub-H2', 'name': 'Sub-H2 Header', 'description': 'Another section', 'icon': '📑'},
+        {'type': 'Body-Copy', 'name': 'Body Copy', 'description': 'More content', 'icon': '📄'},
+        {'type': 'Closing', 'name': 'Closing Statement', 'description': 'Article conclusion', 'icon': '✅'},
+        {'type': 'CTA', 'name': 'Call to Action', 'description': 'Reader next step', 'icon': '🚀'}
+    )
+})
 
-WRITING GUIDELINES:
+_WRITING_GUIDELINES: Final[str] = """WRITING GUIDELINES:
 - Use professional, engaging language that doesn't sound AI-generated
-- Avoid generic phrases like "cutting-edge," "world-class," "seamless experience"
-- Include specific, concrete benefits rather than vague promises  
+- Include specific, concrete benefits rather than vague promises
 - Write in a conversational yet professional tone
-- Ensure smooth flow between sections
-- Make each section distinct and valuable
-- Include clear formatting with headers and structure
 - Focus on customer benefits and real-world value
-- IMPORTANT: When a word count is specified, count WORDS not characters. A 1000-word article should contain approximately 1000 individual words.
+- Integrate SEO keywords naturally, without keyword stuffing
+- IMPORTANT: When a word count is specified, count WORDS not characters."""
 
-Format the output with clear section headers and proper structure for web content."""
-    
-    return prompt
+# Everything invariant goes in the system message so every request starts
+# with the same long prefix, which OpenAI's prompt cache can reuse; the
+# per-request details follow in the user message
+_STATIC_SYSTEM_PROMPT: Final[str] = "\n\n".join([
+    _SYSTEM_PROMPT,
+    _WRITING_GUIDELINES,
+    "PAGE SECTIONS - When asked to write one section of a page outline, write only that "
+    "section with its section header, make it flow naturally from the one before it, and "
+    "follow the description for its section type:\n"
+    + "\n".join(f"- {name}: {text}" for name, text in _SECTION_DESCRIPTIONS.items())
+])
 
-def create_content_prompt(content_type: str, business_info: Dict, keywords: List[str], 
-                         sections: List[str] = None, word_count: int = None, 
-                         custom_requirements: str = None) -> str:
-    """Create a detailed prompt for content generation"""
-    
-    base_prompts = {
-        "Home Page": f"""Create a compelling home page for {business_info['business_name']}, a {business_info['industry']} business.
+# Phrases the system prompt tells the model to avoid, checked again after generation
+_BANNED_PHRASES = (
+    "In today's digital landscape",
+    "cutting-edge solutions",
+    "game-changing",
+    "revolutionary",
+    "seamless experience",
+    "world-class",
+    "state-of-the-art",
+    "leverage synergies"
+)
+
+# One alternation scans the text once for every phrase; word boundaries keep
+# "revolutionary" from matching inside "counterrevolutionary", and apostrophes
+# also match the typographic form the model often emits
+_BANNED_PHRASES_RE = phrase_re.compile(
+    r"(?i)\b(?:" + "|".join(re.escape(p).replace("'", "['’]") for p in _BANNED_PHRASES) + r")\b"
+)
+
+# Page templates for Quick Generate, filled with str.format_map so only the
+# selected template is formatted
+_CONTENT_TEMPLATES: Dict[str, str] = {
+    "Home Page": """Create a compelling home page for {business_name}, a {industry} business.
         
 Business Details:
-- Industry: {business_info['industry']}
-- Location: {business_info.get('location', 'Not specified')}
-- Target Audience: {business_info.get('target_audience', 'General consumers')}
-- Unique Value Proposition: {business_info.get('value_prop', 'Professional services')}
+- Industry: {industry}
+- Location: {location}
+- Target Audience: {target_audience}
+- Unique Value Proposition: {value_prop}
 
 Structure the content with:
 - Compelling headline that addresses customer pain points
@@ -160,13 +345,13 @@ Structure the content with:
 - Trust indicators
 - Strong call-to-action""",
 
-        "Service Page": f"""Create a detailed service page for {business_info['service_name']} offered by {business_info['business_name']}.
+    "Service Page": """Create a detailed service page for {service_name} offered by {business_name}.
         
 Service Details:
-- Service: {business_info['service_name']}
-- Industry: {business_info['industry']}
-- Target Audience: {business_info.get('target_audience', 'General consumers')}
-- Key Benefits: {business_info.get('benefits', 'Professional expertise')}
+- Service: {service_name}
+- Industry: {industry}
+- Target Audience: {target_audience}
+- Key Benefits: {benefits}
 
 Structure should include:
 - Service overview
@@ -175,13 +360,13 @@ Structure should include:
 - Pricing or consultation CTA
 - FAQ section""",
 
-        "Blog Post": f"""Write an informative blog post about {business_info['topic']} for {business_info['business_name']}'s audience.
+    "Blog Post": """Write an informative blog post about {topic} for {business_name}'s audience.
         
 Blog Details:
-- Topic: {business_info['topic']}
-- Industry: {business_info['industry']}
-- Target Audience: {business_info.get('target_audience', 'General readers')}
-- Purpose: {business_info.get('purpose', 'Educate and inform')}
+- Topic: {topic}
+- Industry: {industry}
+- Target Audience: {target_audience}
+- Purpose: {purpose}
 
 Structure:
 - Engaging introduction
@@ -189,14 +374,14 @@ Structure:
 - Actionable insights
 - Conclusion with next steps""",
 
-        "About Page": f"""Create an engaging About page for {business_info['business_name']}.
+    "About Page": """Create an engaging About page for {business_name}.
         
 Company Details:
-- Business: {business_info['business_name']}
-- Industry: {business_info['industry']}
-- Founded: {business_info.get('founded', 'Recently established')}
-- Mission: {business_info.get('mission', 'Serving customers with excellence')}
-- Team Size: {business_info.get('team_size', 'Professional team')}
+- Business: {business_name}
+- Industry: {industry}
+- Founded: {founded}
+- Mission: {mission}
+- Team Size: {team_size}
 
 Include:
 - Company story and mission
@@ -204,31 +389,853 @@ Include:
 - Values and approach
 - Credentials and experience
 - Personal touch that builds trust"""
-    }
+}
+
+_DEFAULT_TEMPLATE = "Create professional {content_type} content for {business_name}."
+
+_PROMPT_DEFAULTS = {
+    'location': 'Not specified',
+    'target_audience': 'General consumers',
+    'value_prop': 'Professional services',
+    'benefits': 'Professional expertise',
+    'purpose': 'Educate and inform',
+    'founded': 'Recently established',
+    'mission': 'Serving customers with excellence',
+    'team_size': 'Professional team'
+}
+
+_TEMPLATE_DEFAULTS = {
+    "Blog Post": {'target_audience': 'General readers'}
+}
+
+# Select box options, shared by the Quick Generate and Template Builder forms
+_CONTENT_TYPES: Final[Tuple[str, ...]] = ("Home Page", "Service Page", "About Page", "Blog Post",
+                                          "Contact Page", "FAQ Page", "Testimonials Page")
+
+_INDUSTRIES: Final[Tuple[str, ...]] = ("Healthcare", "Legal", "Real Estate", "Automotive", "Restaurant",
+                                       "Fitness", "Beauty/Spa", "Construction", "Technology", "Consulting",
+                                       "Education", "Finance", "Retail", "Other")
+
+_TARGET_AUDIENCES: Final[Tuple[str, ...]] = ("General consumers", "Business owners", "Young professionals",
+                                             "Families", "Seniors", "Students", "Industry professionals")
+
+_TONES: Final[Tuple[str, ...]] = ("Professional", "Friendly", "Authoritative", "Conversational")
+
+@st.cache_resource
+def get_event_loop() -> asyncio.AbstractEventLoop:
+    """Start the background event loop shared by all sessions"""
+    # Cached async clients keep connection pools bound to the loop that first
+    # used them, so every coroutine runs here rather than under asyncio.run
+    loop = uvloop.new_event_loop() if uvloop else asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+    return loop
+
+def run_async(coro):
+    """Run a coroutine on the shared event loop and wait for its result"""
+    return asyncio.run_coroutine_threadsafe(coro, get_event_loop()).result()
+
+class HistoryStore:
+    """Content history and submitted batch jobs persisted to a local SQLite file"""
     
-    prompt = base_prompts.get(content_type, f"Create professional {content_type.lower()} content for {business_info['business_name']}.")
+    def __init__(self, path: str = HISTORY_DB_PATH):
+        self._db = run_async(self._connect(path))
+    
+    @staticmethod
+    async def _connect(path: str) -> aiosqlite.Connection:
+        db = await aiosqlite.connect(path)
+        # WAL lets sessions read history while a background write is in flight
+        await db.execute("PRAGMA journal_mode=WAL")
+        await db.execute("CREATE TABLE IF NOT EXISTS history"
+                         "(ts TEXT, type TEXT, business TEXT, content TEXT, account TEXT)")
+        # Files from before entries had an owner gain the column; their rows
+        # stay NULL, so no key can read them
+        async with db.execute("PRAGMA table_info(history)") as cursor:
+            columns = {row[1] for row in await cursor.fetchall()}
+        if 'account' not in columns:
+            await db.execute("ALTER TABLE history ADD COLUMN account TEXT")
+        await db.execute("CREATE INDEX IF NOT EXISTS history_account ON history(account)")
+        # Batches take up to a day, so they are tracked here rather than in a
+        # session that a refresh would lose; pages is the custom_id map as JSON
+        await db.execute("CREATE TABLE IF NOT EXISTS batch_jobs"
+                         "(id TEXT PRIMARY KEY, account TEXT, submitted TEXT, status TEXT, pages TEXT)")
+        await db.commit()
+        return db
+    
+    @staticmethod
+    def _filter(account: str, business_q: str) -> tuple:
+        if business_q:
+            return " WHERE account = ? AND instr(lower(business), lower(?)) > 0", (account, business_q)
+        return " WHERE account = ?", (account,)
+    
+    def count(self, account: str, business_q: str = "") -> int:
+        """Count one API key's entries, optionally only those whose business contains business_q"""
+        return run_async(self._count_async(account, business_q))
+    
+    async def _count_async(self, account: str, business_q: str) -> int:
+        where, params = self._filter(account, business_q)
+        async with self._db.execute("SELECT count(*) FROM history" + where, params) as cursor:
+            (total,) = await cursor.fetchone()
+        return total
+    
+    def page(self, account: str, offset: int, limit: int = HISTORY_PAGE_SIZE,
+             business_q: str = "") -> List[tuple]:
+        """Read one page of an API key's (id, timestamp, type, business, preview) rows, newest first"""
+        return run_async(self._page_async(account, offset, limit, business_q))
+    
+    async def _page_async(self, account: str, offset: int, limit: int, business_q: str) -> List[tuple]:
+        where, params = self._filter(account, business_q)
+        async with self._db.execute(
+            "SELECT rowid, ts, type, business, substr(content, 1, ?) FROM history" + where +
+            " ORDER BY rowid DESC LIMIT ? OFFSET ?",
+            (HISTORY_PREVIEW_CHARS, *params, limit, offset)
+        ) as cursor:
+            return await cursor.fetchall()
+    
+    def content(self, account: str, entry_id: int) -> str:
+        """Read the full text of one of an API key's entries"""
+        return run_async(self._content_async(account, entry_id))
+    
+    async def _content_async(self, account: str, entry_id: int) -> str:
+        async with self._db.execute("SELECT content FROM history WHERE rowid = ? AND account = ?",
+                                    (entry_id, account)) as cursor:
+            row = await cursor.fetchone()
+        return row[0] if row else ""
+    
+    def add(self, entry: Dict[str, str]):
+        """Write an entry in the background without waiting for it"""
+        future = asyncio.run_coroutine_threadsafe(self._add_async(entry), get_event_loop())
+        future.add_done_callback(lambda f: self._log_failed_add(f, entry))
+    
+    @staticmethod
+    def _log_failed_add(future, entry: Dict[str, str]):
+        # Nobody waits on the write, so a failure (locked database, full
+        # disk) would otherwise vanish along with the entry
+        if not future.cancelled() and future.exception() is not None:
+            logger.error("Couldn't save %s for %s to history", entry['type'], entry['business'],
+                         exc_info=future.exception())
+    
+    async def _add_async(self, entry: Dict[str, str]):
+        await self._db.execute("INSERT INTO history VALUES (?, ?, ?, ?, ?)",
+                               (entry['timestamp'], entry['type'], entry['business'], entry['content'],
+                                entry['account']))
+        await self._db.commit()
+
+    def batch_jobs(self, account: str) -> List[Dict[str, Any]]:
+        """Read the batch jobs submitted with one API key, newest first"""
+        return run_async(self._batch_jobs_async(account))
+    
+    async def _batch_jobs_async(self, account: str) -> List[Dict[str, Any]]:
+        async with self._db.execute(
+            "SELECT id, submitted, status, pages FROM batch_jobs WHERE account = ? ORDER BY rowid DESC",
+            (account,)
+        ) as cursor:
+            rows = await cursor.fetchall()
+        return [{'id': job_id, 'submitted': submitted, 'status': status, 'pages': json.loads(pages)}
+                for job_id, submitted, status, pages in rows]
+    
+    def save_batch_job(self, account: str, job: Dict[str, Any]):
+        """Insert or update a batch job, waiting for the write so its id is never lost"""
+        run_async(self._save_batch_job_async(account, job))
+    
+    async def _save_batch_job_async(self, account: str, job: Dict[str, Any]):
+        await self._db.execute(
+            "INSERT INTO batch_jobs VALUES (?, ?, ?, ?, ?) "
+            "ON CONFLICT(id) DO UPDATE SET status = excluded.status",
+            (job['id'], account, job['submitted'], job['status'], json.dumps(job['pages']))
+        )
+        await self._db.commit()
+
+@st.cache_resource
+def get_history_store() -> HistoryStore:
+    """Open the history database once per process"""
+    return HistoryStore()
+
+def record_history(account: str, content_type: str, business: str, content: str):
+    """Persist a generated page to an API key's history in the background"""
+    # Fire-and-forget: the write overlaps with whatever the user does next
+    get_history_store().add({
+        'timestamp': time.strftime("%Y-%m-%d %H:%M:%S"),
+        'type': content_type,
+        'business': business,
+        'content': content,
+        'account': account
+    })
+
+@st.cache_resource
+def get_encoding(model: str = DEFAULT_MODEL) -> tiktoken.Encoding:
+    """Load a model's tokenizer once per process"""
+    return tiktoken.encoding_for_model(model)
+
+def count_tokens(text: str, model: str = DEFAULT_MODEL) -> Optional[int]:
+    """Count tokens with the model's tokenizer, or None when it can't be loaded"""
+    try:
+        encoding = get_encoding(model)
+    except Exception:  # first use downloads the BPE file, which fails offline
+        return None
+    return len(encoding.encode(text))
+
+def max_tokens_for(word_count: int = None, sections: int = 1) -> int:
+    """Size the completion budget from the target word count, split across a page's sections"""
+    if word_count:
+        share = min(1.0, SECTION_BUDGET_SLACK / sections)
+        return int(word_count * TOKENS_PER_WORD * share) + MAX_TOKENS_MARGIN
+    return DEFAULT_MAX_TOKENS
+
+def pick_model(quality: str, word_count: int = None, auto_tier: str = "Fast") -> str:
+    """Route a request to a model from the quality tier and job length"""
+    if quality == AUTO_TIER:
+        quality = auto_tier
+    if quality == "Fast" and (word_count or 0) > LONG_JOB_WORDS:
+        return MODEL_TIERS["Balanced"]
+    return MODEL_TIERS.get(quality, DEFAULT_MODEL)
+
+def check_context_budget(prompt: str, max_tokens: int, model: str = DEFAULT_MODEL):
+    """Fail before calling the API when the prompt and completion won't fit the context window"""
+    prompt_tokens = count_tokens(_STATIC_SYSTEM_PROMPT + prompt, model)
+    if prompt_tokens is None:
+        return  # no tokenizer; an oversized request still comes back as a BadRequestError
+    context_window = MODEL_CONTEXT_WINDOWS.get(model, MODEL_CONTEXT_WINDOWS["gpt-4"])
+    if prompt_tokens + max_tokens > context_window:
+        raise ValueError(
+            f"Prompt ({prompt_tokens} tokens) plus requested output ({max_tokens} tokens) "
+            f"exceeds {model}'s {context_window}-token context window. "
+            "Shorten the keywords or custom requirements, or lower the word count."
+        )
+
+def iter_async(agen):
+    """Iterate an async generator from the script thread via the shared event loop"""
+    while True:
+        try:
+            yield run_async(agen.__anext__())
+        except StopAsyncIteration:
+            return
+
+class ResponseCache:
+    """Thread-safe LRU of completion variants keyed by a hash of the full request"""
+    
+    def __init__(self, maxsize: int = RESPONSE_CACHE_SIZE, directory: str = RESPONSE_CACHE_DIR):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._disk = diskcache.Cache(directory)
+    
+    @staticmethod
+    def make_key(*parts) -> bytes:
+        digest = hashlib.blake2b(digest_size=16)
+        for part in parts:
+            digest.update(str(part).encode("utf-8"))
+            digest.update(b"\0")
+        return digest.digest()
+    
+    def get(self, key: bytes):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+                return value
+        value = self._disk.get(key)
+        if value is not None:
+            self._remember(key, value)
+        return value
+    
+    def set(self, key: bytes, value: tuple):
+        self._remember(key, value)
+        self._disk.set(key, value, expire=RESPONSE_CACHE_TTL_SECONDS)
+    
+    def _remember(self, key: bytes, value: tuple):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+class SemanticCache:
+    """Completions looked up by prompt-embedding similarity, persisted to SQLite"""
+    
+    def __init__(self, path: str = SEMANTIC_CACHE_PATH,
+                 threshold: float = SEMANTIC_CACHE_THRESHOLD,
+                 ttl: float = SEMANTIC_CACHE_TTL_SECONDS):
+        self.threshold = threshold
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("CREATE TABLE IF NOT EXISTS semantic_cache_int8"
+                         "(scope BLOB, scale REAL, embedding BLOB, response TEXT, ts REAL)")
+        self._db.execute("DELETE FROM semantic_cache_int8 WHERE ts < ?", (time.time() - ttl,))
+        self._db.commit()
+        # The float32 table predates quantization and is never read; drop it
+        # once and give its pages back to the filesystem
+        if self._db.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' "
+                            "AND name = 'semantic_cache'").fetchone():
+            self._db.execute("DROP TABLE semantic_cache")
+            self._db.commit()
+            self._db.execute("VACUUM")
+        # Per scope: an int8 matrix of quantized embeddings with one scale per
+        # row, plus the parallel responses - a quarter of the float32 footprint
+        self._scopes = {}
+        for scope, scale, embedding, response, ts in self._db.execute("SELECT * FROM semantic_cache_int8"):
+            self._append(scope, np.frombuffer(embedding, dtype=np.int8), scale, tuple(json.loads(response)), ts)
+    
+    def _append(self, scope: bytes, quantized: np.ndarray, scale: float, response: tuple, ts: float):
+        matrix, scales, responses, stamps = self._scopes.get(
+            scope, (np.empty((0, quantized.size), np.int8), np.empty(0, np.float32), [], []))
+        self._scopes[scope] = (np.vstack([matrix, quantized]), np.append(scales, np.float32(scale)),
+                               responses + [response], stamps + [ts])
+    
+    @staticmethod
+    def normalize(embedding: List[float]) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32)
+        return vector / np.linalg.norm(vector)
+    
+    @staticmethod
+    def quantize(vector: np.ndarray) -> tuple:
+        """Scale a vector into int8 so its largest component maps to +/-127"""
+        scale = float(np.abs(vector).max()) / 127 or 1.0
+        return np.rint(vector / scale).astype(np.int8), scale
+    
+    def get(self, scope: bytes, vector: np.ndarray):
+        quantized, scale = self.quantize(vector)
+        with self._lock:
+            if scope not in self._scopes:
+                return None
+            matrix, scales, responses, stamps = self._scopes[scope]
+            # Integer dot products, rescaled back to cosine similarity
+            similarities = np.matmul(matrix, quantized, dtype=np.int32) * scales * scale
+            best = int(similarities.argmax())
+            if similarities[best] >= self.threshold and time.time() - stamps[best] < self.ttl:
+                return responses[best]
+            return None
+    
+    def set(self, scope: bytes, vector: np.ndarray, value: tuple):
+        self.set_many([(scope, vector, value)])
+    
+    def set_many(self, entries: List[tuple]):
+        """Store (scope, vector, value) entries with a single commit"""
+        now = time.time()
+        rows = []
+        with self._lock:
+            for scope, vector, value in entries:
+                quantized, scale = self.quantize(vector)
+                self._append(scope, quantized, scale, value, now)
+                rows.append((scope, scale, quantized.tobytes(), json.dumps(value), now))
+            self._db.executemany("INSERT INTO semantic_cache_int8 VALUES (?, ?, ?, ?, ?)", rows)
+            self._db.commit()
+
+def is_retryable(error: BaseException) -> bool:
+    """Transient failures are retried; an exhausted quota is not, since waiting won't refill it"""
+    return isinstance(error, RETRYABLE_ERRORS) and getattr(error, 'code', None) != 'insufficient_quota'
+
+@st.cache_resource
+def get_semantic_cache() -> SemanticCache:
+    """Load the semantic cache once per process"""
+    return SemanticCache()
+
+class ContentGenerator:
+    def __init__(self, api_key: str):
+        # Keep connections warm between clicks; the pool is capped at a level
+        # that suits OpenAI rate limits rather than httpx's default of 100
+        self.client = AsyncOpenAI(
+            api_key=api_key,
+            max_retries=0,  # retries are handled by _create_completion
+            timeout=httpx.Timeout(HTTP_TIMEOUT_SECONDS, connect=HTTP_CONNECT_TIMEOUT_SECONDS),
+            http_client=DefaultAsyncHttpxClient(
+                limits=httpx.Limits(
+                    max_connections=HTTP_MAX_CONNECTIONS,
+                    max_keepalive_connections=HTTP_MAX_CONNECTIONS,
+                    keepalive_expiry=HTTP_KEEPALIVE_SECONDS
+                )
+            )
+        )
+        self.response_cache = ResponseCache()
+        # Names this key's stored batch jobs without writing the key to disk
+        self.account = hashlib.sha256(api_key.encode()).hexdigest()[:16]
+        # The system message never changes, so every request shares one dict
+        self._system_message = {"role": "system", "content": self.get_system_prompt()}
+        self.semantic_cache = get_semantic_cache()
+        # Caps in-flight requests across every caller sharing this generator
+        self._semaphore = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+        # Spreads requests under the account's RPM quota so bursts queue here
+        # instead of coming back as 429s; retries handle whatever slips through
+        self._rate_limiter = AsyncLimiter(REQUESTS_PER_MINUTE, 60)
+        self._token_limiter = AsyncLimiter(TOKENS_PER_MINUTE, 60)
+        self._account_error = None
+        self._account_error_until = 0.0
+        # Prompt tokens billed vs. served from OpenAI's prefix cache
+        self.usage = {'prompt_tokens': 0, 'cached_tokens': 0}
+        self._usage_lock = threading.Lock()
+    
+    def _record_usage(self, usage):
+        if usage is None:
+            return
+        details = getattr(usage, 'prompt_tokens_details', None)
+        with self._usage_lock:
+            self.usage['prompt_tokens'] += usage.prompt_tokens
+            self.usage['cached_tokens'] += getattr(details, 'cached_tokens', 0) or 0
+        
+    # Both caches are shared by every key on the machine, so each key only
+    # ever sees answers it generated itself
+    def _cache_key(self, prompt: str, max_tokens: int, n: int, model: str) -> bytes:
+        return ResponseCache.make_key(self.account, model, self.get_system_prompt(), max_tokens, n, prompt)
+    
+    def _semantic_scope(self, scope: str, max_tokens: int, n: int, model: str) -> bytes:
+        # Only prompts for the same business and request shape may share an
+        # answer, however similar their wording
+        return ResponseCache.make_key(self.account, model, self.get_system_prompt(), max_tokens, n, scope)
+    
+    def _estimate_tokens(self, prompt: str, max_tokens: int, n: int) -> int:
+        prompt_chars = len(self._system_message['content']) + len(prompt)
+        return min(prompt_chars // CHARS_PER_TOKEN + max_tokens * n, TOKENS_PER_MINUTE)
+    
+    def _check_account(self):
+        # Checked after queueing, so requests already waiting on the limiters
+        # when the error arrived don't go out either
+        if self._account_error is not None and time.monotonic() < self._account_error_until:
+            raise self._account_error
+    
+    def _note_account_error(self, error: OpenAIError):
+        if isinstance(error, AuthenticationError) or getattr(error, 'code', None) == 'insufficient_quota':
+            self._account_error = error
+            self._account_error_until = time.monotonic() + ACCOUNT_ERROR_COOLDOWN_SECONDS
+    
+    async def _embed_async(self, texts: List[str]) -> List[np.ndarray]:
+        async with self._rate_limiter:
+            self._check_account()
+            try:
+                response = await self.client.embeddings.create(model=EMBEDDING_MODEL, input=texts)
+            except OpenAIError as e:
+                self._note_account_error(e)
+                raise
+        return [SemanticCache.normalize(item.embedding) for item in response.data]
+    
+    @retry(retry=retry_if_exception(is_retryable),
+           wait=wait_random_exponential(min=1, max=30),
+           stop=stop_after_attempt(MAX_REQUEST_ATTEMPTS),
+           reraise=True)
+    async def _create_completion(self, prompt: str, max_tokens: int, n: int = 1,
+                                 stream: bool = False, model: str = DEFAULT_MODEL):
+        """Call Chat Completions, retrying rate limits, server errors and transient network errors"""
+        async with self._rate_limiter:
+            self._check_account()
+            try:
+                return await self.client.chat.completions.create(
+                    model=model,
+                    messages=[self._system_message, {"role": "user", "content": prompt}],
+                    max_tokens=max_tokens,
+                    temperature=0.7,
+                    n=n,
+                    stream=stream,
+                    **({'stream_options': {'include_usage': True}} if stream else {})
+                )
+            except OpenAIError as e:
+                self._note_account_error(e)
+                raise
+    
+    @asynccontextmanager
+    async def _open_stream(self, prompt: str, max_tokens: int, n: int = 1,
+                           model: str = DEFAULT_MODEL):
+        """Open a streamed completion, holding a concurrency slot until it is read or closed"""
+        # create() returns once headers arrive, so the slot has to cover the
+        # whole body; token capacity is awaited first so waiting holds no slot
+        await self._token_limiter.acquire(self._estimate_tokens(prompt, max_tokens, n))
+        async with self._semaphore:
+            stream = await self._create_completion(prompt, max_tokens, n, stream=True, model=model)
+            async with stream:
+                yield stream
+    
+    async def stream_content(self, prompt: str, max_tokens: int = DEFAULT_MAX_TOKENS,
+                             n: int = 1, variants: List[str] = None, model: str = DEFAULT_MODEL):
+        """Yield the first choice's text as it streams in; all n choices are stored in variants"""
+        buffers = [[] for _ in range(n)]
+        async with self._open_stream(prompt, max_tokens, n, model) as stream:
+            async for chunk in stream:
+                self._record_usage(chunk.usage)
+                for choice in chunk.choices:
+                    delta = choice.delta.content
+                    if not delta:
+                        continue
+                    buffers[choice.index].append(delta)
+                    if choice.index == 0:
+                        yield delta
+        if variants is not None:
+            variants[:] = ["".join(parts) for parts in buffers]
+    
+    def stream_variants(self, prompt: str, variants: List[str],
+                        max_tokens: int = DEFAULT_MAX_TOKENS, n: int = VARIANTS_PER_REQUEST,
+                        model: str = DEFAULT_MODEL, use_cache: bool = True, scope: str = None):
+        """Stream the first variant for st.write_stream, filling variants once the response ends"""
+        key = self._cache_key(prompt, max_tokens, n, model)
+        cached = self.response_cache.get(key) if use_cache else None
+        
+        # Fall back to a near-duplicate prompt within the same scope
+        vector = None
+        if cached is None and scope:
+            semantic_scope = self._semantic_scope(scope, max_tokens, n, model)
+            try:
+                vector = run_async(self._embed_async([prompt]))[0]
+            except OpenAIError:
+                pass  # the semantic cache is an optimization; generate normally
+            else:
+                cached = self.semantic_cache.get(semantic_scope, vector) if use_cache else None
+        
+        if cached:
+            variants[:] = cached
+            yield cached[0]
+            return
+        
+        try:
+            check_context_budget(prompt, max_tokens, model)
+            yield from iter_async(self.stream_content(prompt, max_tokens, n, variants, model))
+        except BadRequestError as e:
+            st.error(f"OpenAI rejected the request: {e.message}")
+        except Exception as e:
+            st.error(f"Error generating content: {str(e)}")
+        else:
+            if variants and variants[0]:
+                self.response_cache.set(key, tuple(variants))
+                if vector is not None:
+                    self.semantic_cache.set(semantic_scope, vector, tuple(variants))
+    
+    async def _stream_section(self, index: int, prompt: str, max_tokens: int,
+                              model: str, queue: asyncio.Queue):
+        async with self._open_stream(prompt, max_tokens, model=model) as stream:
+            async for chunk in stream:
+                self._record_usage(chunk.usage)
+                for choice in chunk.choices:
+                    if choice.delta.content:
+                        await queue.put((index, choice.delta.content))
+    
+    async def _stream_sections(self, prompts: Dict[int, str], max_tokens: int,
+                               model: str = DEFAULT_MODEL):
+        """Stream every section concurrently, yielding (index, delta) as tokens arrive"""
+        queue = asyncio.Queue()
+        tasks = [asyncio.create_task(self._stream_section(i, p, max_tokens, model, queue))
+                 for i, p in prompts.items()]
+        
+        async def close_when_done():
+            try:
+                await asyncio.gather(*tasks)
+            finally:
+                await queue.put(None)
+        closer = asyncio.create_task(close_when_done())
+        
+        try:
+            while (item := await queue.get()) is not None:
+                yield item
+            await closer  # surfaces the first section error, if any
+        finally:
+            for task in tasks:
+                task.cancel()
+    
+    def generate_sections(self, prompts: List[str], max_tokens: int = DEFAULT_MAX_TOKENS,
+                          model: str = DEFAULT_MODEL, use_cache: bool = True,
+                          placeholders: List = None, scopes: List[str] = None) -> List[str]:
+        """Generate one completion per prompt concurrently, streaming each into its placeholder if given"""
+        keys = [self._cache_key(prompt, max_tokens, 1, model) for prompt in prompts]
+        results = [self.response_cache.get(key) if use_cache else None for key in keys]
+        texts = {i: "" for i, cached in enumerate(results) if cached is None}
+        
+        # Embed every uncached prompt in one request, then fall back to a
+        # near-duplicate within each prompt's own scope
+        vectors = {}
+        if scopes and texts:
+            semantic_scopes = [self._semantic_scope(scope, max_tokens, 1, model) for scope in scopes]
+            try:
+                vectors = dict(zip(texts, run_async(self._embed_async([prompts[i] for i in texts]))))
+            except OpenAIError:
+                pass  # the semantic cache is an optimization; generate normally
+            for i, vector in vectors.items():
+                cached = self.semantic_cache.get(semantic_scopes[i], vector) if use_cache else None
+                if cached:
+                    results[i] = cached
+                    del texts[i]
+        if placeholders:
+            for placeholder, cached in zip(placeholders, results):
+                if cached:
+                    placeholder.markdown(cached[0])
+        
+        try:
+            for i in texts:
+                check_context_budget(prompts[i], max_tokens, model)
+            for i, delta in iter_async(self._stream_sections({i: prompts[i] for i in texts},
+                                                             max_tokens, model)):
+                texts[i] += delta
+                if placeholders:
+                    placeholders[i].markdown(texts[i])
+        except BadRequestError as e:
+            st.error(f"OpenAI rejected the request: {e.message}")
+            return []
+        except Exception as e:
+            st.error(f"Error generating content: {str(e)}")
+            return []
+        
+        for i, content in texts.items():
+            results[i] = (content,)
+            if content:
+                self.response_cache.set(keys[i], results[i])
+        self.semantic_cache.set_many([(semantic_scopes[i], vectors[i], results[i])
+                                      for i, content in texts.items() if content and i in vectors])
+        return [cached[0] for cached in results]
+    
+    def submit_batch(self, prompts: Dict[str, str], max_tokens: int = DEFAULT_MAX_TOKENS,
+                     model: str = DEFAULT_MODEL) -> str:
+        """Upload prompts keyed by custom_id as a Batch API job and return its id"""
+        try:
+            return run_async(self._submit_batch_async(prompts, max_tokens, model))
+        except Exception as e:
+            st.error(f"Error submitting batch: {str(e)}")
+            return ""
+    
+    async def _submit_batch_async(self, prompts: Dict[str, str], max_tokens: int, model: str) -> str:
+        lines = [
+            json.dumps({
+                "custom_id": custom_id,
+                "method": "POST",
+                "url": "/v1/chat/completions",
+                "body": {
+                    "model": model,
+                    "messages": [self._system_message, {"role": "user", "content": prompt}],
+                    "max_tokens": max_tokens,
+                    "temperature": 0.7
+                }
+            })
+            for custom_id, prompt in prompts.items()
+        ]
+        buffer = io.BytesIO("\n".join(lines).encode("utf-8"))
+        batch_file = await self.client.files.create(file=("batch.jsonl", buffer), purpose="batch")
+        batch = await self.client.batches.create(
+            input_file_id=batch_file.id,
+            endpoint="/v1/chat/completions",
+            completion_window="24h"
+        )
+        return batch.id
+    
+    def retrieve_batch(self, batch_id: str) -> Dict[str, Any]:
+        """Check a batch job, returning its status and, once it has finished, results and failures by custom_id"""
+        try:
+            return run_async(self._retrieve_batch_async(batch_id))
+        except Exception as e:
+            st.error(f"Error checking batch: {str(e)}")
+            return {'status': 'unknown', 'results': {}, 'failures': {}}
+    
+    async def _retrieve_batch_async(self, batch_id: str) -> Dict[str, Any]:
+        batch = await self.client.batches.retrieve(batch_id)
+        results, failures = {}, {}
+        if batch.status in BATCH_TERMINAL_STATUSES:
+            # Expired and cancelled batches keep the rows that finished; rows
+            # that failed are in the error file or come back as non-200s
+            for file_id in (batch.output_file_id, batch.error_file_id):
+                if not file_id:
+                    continue
+                output = await self.client.files.content(file_id)
+                for line in output.text.splitlines():
+                    if not line.strip():
+                        continue
+                    record = json.loads(line)
+                    response = record.get('response') or {}
+                    body = response.get('body') or {}
+                    if response.get('status_code') == 200 and body.get('choices'):
+                        results[record['custom_id']] = body['choices'][0]['message']['content']
+                    else:
+                        error = record.get('error') or body.get('error') or {}
+                        failures[record['custom_id']] = (error.get('message')
+                                                         or f"HTTP {response.get('status_code')}")
+            # A batch that failed validation never ran any rows
+            if batch.errors and batch.errors.data:
+                for error in batch.errors.data:
+                    failures[f"line {error.line}" if error.line else batch_id] = error.message
+        return {'status': batch.status, 'results': results, 'failures': failures}
+    
+    def get_system_prompt(self) -> str:
+        return _STATIC_SYSTEM_PROMPT
+
+@st.cache_resource(max_entries=4)
+def get_generator(api_key: str) -> ContentGenerator:
+    """Reuse one generator (and its HTTP connection pool) per API key across reruns"""
+    return ContentGenerator(api_key)
+
+def parse_keywords(text: str) -> tuple:
+    """Parse a one-per-line keyword text area into a hashable tuple"""
+    return tuple(k for k in map(str.strip, text.splitlines()) if k)
+
+@st.cache_data(max_entries=128, show_spinner=False)
+def create_section_prompt(template_sections: List[Dict], section_index: int,
+                          business_info: Dict, keywords: List[str],
+                          word_count: int = None, custom_requirements: str = None) -> str:
+    """Create a prompt for a single section of the template structure"""
+    
+    parts = [f"""Create professional web content for {business_info['business_name']}, a {business_info['industry']} business.
+
+Business Details:
+- Name: {business_info['business_name']}
+- Industry: {business_info['industry']}
+- Target Audience: {business_info.get('target_audience', 'General consumers')}
+
+PAGE OUTLINE - The page is built from these sections in this order (each section is written separately):
+"""]
+    
+    parts.extend(f"\n{i+1}. {section['name']}" for i, section in enumerate(template_sections))
+    
+    # Everything above the section task is identical for every section of
+    # the page, so concurrent section requests share one cacheable prefix
     
     # Add keyword requirements
     if keywords:
-        keyword_text = ", ".join(keywords)
-        prompt += f"\n\nSEO Keywords to naturally integrate: {keyword_text}"
-        prompt += "\nIntegrate these keywords naturally throughout the content without keyword stuffing."
+        parts.append(f"\n\nSEO KEYWORDS to integrate naturally: {', '.join(keywords)}")
+        parts.append("\nUse only the keywords that fit your section; the other sections cover the rest.")
+    
+    # Add word count
+    if word_count:
+        parts.append(f"\n\nTARGET WORD COUNT: The full page is approximately {word_count} WORDS (not characters) across {len(template_sections)} sections. Size your section proportionately - headers and CTAs stay short, body sections carry most of the words.")
+    
+    # Add custom requirements
+    if custom_requirements:
+        parts.append(f"\n\nCUSTOM REQUIREMENTS: {custom_requirements}")
+    
+    section = template_sections[section_index]
+    parts.append(f"\n\nYOUR TASK - Write ONLY section {section_index+1}: **{section['name'].upper()}**")
+    if section['type'] in _SECTION_DESCRIPTIONS:
+        parts.append(f" ({section['type']} section)")
+    else:
+        parts.append("\n   Create appropriate content for this section.")
+    
+    return "".join(parts)
+
+@st.cache_data(max_entries=128, show_spinner=False)
+def create_content_prompt(content_type: str, business_info: Dict, keywords: List[str], 
+                         sections: List[str] = None, word_count: int = None, 
+                         custom_requirements: str = None) -> str:
+    """Create a detailed prompt for content generation"""
+    
+    template = _CONTENT_TEMPLATES.get(content_type, _DEFAULT_TEMPLATE)
+    parts = [template.format_map(ChainMap(business_info, {'content_type': content_type.lower()},
+                                          _TEMPLATE_DEFAULTS.get(content_type, {}), _PROMPT_DEFAULTS))]
+    if business_info.get('tone'):
+        parts.append(f"\nTone: {business_info['tone']}")
+    
+    # Add keyword requirements
+    if keywords:
+        parts.append(f"\n\nSEO Keywords to naturally integrate: {', '.join(keywords)}")
     
     # Add custom sections
     if sections:
-        prompt += f"\n\nRequired sections: {', '.join(sections)}"
+        parts.append(f"\n\nRequired sections: {', '.join(sections)}")
     
     # Add word count
     if word_count:
-        prompt += f"\n\nTarget word count: approximately {word_count} WORDS (not characters)."
+        parts.append(f"\n\nTarget word count: approximately {word_count} WORDS (not characters).")
     
     # Add custom requirements
     if custom_requirements:
-        prompt += f"\n\nAdditional requirements: {custom_requirements}"
+        parts.append(f"\n\nAdditional requirements: {custom_requirements}")
+    
+    return "".join(parts)
+
+@st.cache_data(max_entries=16, show_spinner=False)
+def analyze_content(text: str, model: str = DEFAULT_MODEL) -> Dict[str, Any]:
+    """Compute the Content Analysis metrics, cached so unchanged text isn't rescanned each rerun"""
+    words = text.split()
+    word_count = len(words)
+    sentences = len([s for s in text.split('.') if s.strip()])
+    return {
+        'words': word_count,
+        'chars': len(text),
+        'chars_no_spaces': len(text.replace(' ', '')),
+        'reading_time': max(1, word_count // 200),
+        'avg_word_length': sum(len(word.strip('.,!?;:"()[]')) for word in words) // word_count if words else 0,
+        'words_per_sentence': word_count // sentences if sentences else 0,
+        'tokens': count_tokens(text, model),
+        'banned_phrases': find_banned_phrases(text)
+    }
+
+def find_banned_phrases(text: str) -> List[str]:
+    """Return the distinct banned AI phrases found in the text, in order of appearance"""
+    found = {}
+    for match in _BANNED_PHRASES_RE.finditer(text):
+        found.setdefault(match.group(0).lower(), match.group(0))
+    return list(found.values())
+
+def warn_banned_phrases(text: str):
+    """Flag banned AI phrases that made it into generated content"""
+    phrases = find_banned_phrases(text)
+    if phrases:
+        st.warning("Generic AI phrases to revise: " + ", ".join(f'"{p}"' for p in phrases))
+
+def show_variants(variants: List[str], prompt: str = None, model: str = DEFAULT_MODEL):
+    """Put the first variant in the editor and keep the rest for Regenerate"""
+    st.session_state.variants = variants
+    st.session_state.variant_idx = 0
+    st.session_state.variant_prompt = prompt
+    st.session_state.variant_model = model
+    st.session_state.generated_content = variants[0]
+
+def move_section(index: int, offset: int):
+    """Swap a template section with its neighbour above (-1) or below (1)"""
+    template = st.session_state.page_template
+    template[index], template[index + offset] = template[index + offset], template[index]
+
+def remove_section(index: int):
+    """Drop a template section, noting when that leaves the template empty"""
+    st.session_state.page_template.pop(index)
+    st.session_state.template_emptied = not st.session_state.page_template
+
+@st.fragment
+def template_editor():
+    """Template Builder section list; reordering and removing rerun only this fragment"""
+    st.subheader("🏗️ Your Page Template")
     
-    prompt += "\n\nEnsure the content sounds natural, professional, and engaging. Avoid generic AI language."
+    if st.session_state.page_template:
+        st.markdown("*Your content will be generated in this order:*")
+        
+        # Display current template
+        for i, section in enumerate(st.session_state.page_template):
+            col_section, col_up, col_down, col_remove = st.columns([6, 1, 1, 1])
+            
+            with col_section:
+                st.markdown(f"**{i+1}.** {section['icon']} {section['name']}")
+                st.caption(section['description'])
+            
+            # Callbacks update the template before the fragment reruns, so
+            # each click costs a single fragment run
+            with col_up:
+                if i > 0:
+                    st.button("⬆️", key=f"up_{i}", help="Move up", on_click=move_section, args=(i, -1))
+            
+            with col_down:
+                if i < len(st.session_state.page_template) - 1:
+                    st.button("⬇️", key=f"down_{i}", help="Move down", on_click=move_section, args=(i, 1))
+            
+            with col_remove:
+                st.button("🗑️", key=f"remove_{i}", help="Remove section", on_click=remove_section, args=(i,))
+            
+            st.divider()
+        
+        # Template actions
+        col_clear, col_save = st.columns(2)
+        with col_clear:
+            if st.button("🗑️ Clear Template", use_container_width=True):
+                st.session_state.page_template = []
+                st.rerun()
+        
+        with col_save:
+            # Could add template saving functionality here
+            st.markdown("*Template ready for generation*")
     
-    return prompt
+    else:
+        # Emptying the template hides the business form, which lives outside
+        # this fragment
+        if st.session_state.pop('template_emptied', False):
+            st.rerun()
+        
+        st.info("👆 Click sections from the left to build your page template")
+        
+        # Quick template presets
+        st.subheader("📋 Quick Templates")
+        
+        for template_name, template_structure in _PRESET_TEMPLATES.items():
+            if st.button(f"📋 Use {template_name}", key=f"preset_{template_name}"):
+                # Copy the sections too - the presets are shared by every session
+                st.session_state.page_template = [dict(section) for section in template_structure]
+                st.rerun()
 
 def main():
     st.title("🚀 Professional Content Generator")
@@ -243,98 +1250,111 @@ def main():
         if not api_key:
             st.warning("Please enter your OpenAI API key to continue")
             st.stop()
+        
+        quality = st.selectbox("Model quality", [AUTO_TIER, *MODEL_TIERS],
+                               help="Fast: gpt-4o-mini, Balanced: gpt-4o, Premium: gpt-4-turbo. "
+                                    "Auto uses Fast for Quick Generate and batches, Balanced for the Template Builder. "
+                                    f"Fast jobs over {LONG_JOB_WORDS} words use the Balanced model.")
+        force_regenerate = st.checkbox("Force regenerate",
+                                       help="Skip cached results and call the API even for identical requests")
+        business_q = st.text_input("Filter by business", help="Narrow the content history to matching businesses")
     
     # Initialize content generator
-    generator = ContentGenerator(api_key)
+    generator = get_generator(api_key)
+    
+    if generator.usage['prompt_tokens']:
+        cached_share = generator.usage['cached_tokens'] / generator.usage['prompt_tokens']
+        st.sidebar.caption(f"Prompt cache: {cached_share:.0%} of "
+                           f"{generator.usage['prompt_tokens']:,} prompt tokens served from cache")
     
     # Main interface tabs
-    tab1, tab2, tab3 = st.tabs(["🎯 Quick Generate", "🏗️ Template Builder", "📝 Content History"])
+    tab1, tab2, tab3, tab4 = st.tabs(["🎯 Quick Generate", "🏗️ Template Builder",
+                                      "📝 Content History", "📦 Batch Jobs"])
     
     with tab1:
         st.header("Quick Content Generation")
         
-        col1, col2 = st.columns([2, 1])
+        # Content Type Selection - kept outside the form so the
+        # type-specific fields below update as soon as it changes
+        st.subheader("Content Type")
+        content_type = st.selectbox("Select Content Type*", _CONTENT_TYPES)
         
-        with col1:
-            # Business Information
-            st.subheader("Business Information")
-            business_name = st.text_input("Business Name*", placeholder="e.g., Smith Dental Practice")
-            industry = st.selectbox("Industry*", [
-                "Healthcare", "Legal", "Real Estate", "Automotive", "Restaurant",
-                "Fitness", "Beauty/Spa", "Construction", "Technology", "Consulting",
-                "Education", "Finance", "Retail", "Other"
-            ])
-            location = st.text_input("Location", placeholder="e.g., Denver, CO")
-            
-            # Content Type Selection
-            st.subheader("Content Type")
-            content_type = st.selectbox("Select Content Type*", [
-                "Home Page", "Service Page", "About Page", "Blog Post", 
-                "Contact Page", "FAQ Page", "Testimonials Page"
-            ])
+        # Inputs are batched in a form so typing doesn't rerun the script
+        with st.form("quick_gen"):
+            col1, col2 = st.columns([2, 1])
             
-            # Additional fields based on content type
-            additional_info = {}
-            if content_type == "Service Page":
-                additional_info['service_name'] = st.text_input("Service Name*", 
-                    placeholder="e.g., Teeth Whitening, Personal Injury Law")
-            elif content_type == "Blog Post":
-                additional_info['topic'] = st.text_input("Blog Topic*", 
-                    placeholder="e.g., Benefits of Regular Dental Checkups")
-        
-        with col2:
-            st.subheader("SEO Keywords")
-            keywords_input = st.text_area("Keywords (one per line)", 
-                placeholder="dental implants\ncosmetic dentistry\nDenver dentist",
-                height=100)
-            keywords = [k.strip() for k in keywords_input.split('\n') if k.strip()]
+            with col1:
+                # Business Information
+                st.subheader("Business Information")
+                business_name = st.text_input("Business Name*", placeholder="e.g., Smith Dental Practice")
+                industry = st.selectbox("Industry*", _INDUSTRIES)
+                location = st.text_input("Location", placeholder="e.g., Denver, CO")
+                
+                # Additional fields based on content type
+                additional_info = {}
+                if content_type == "Service Page":
+                    additional_info['service_name'] = st.text_input("Service Name*", 
+                        placeholder="e.g., Teeth Whitening, Personal Injury Law")
+                elif content_type == "Blog Post":
+                    additional_info['topic'] = st.text_input("Blog Topic*", 
+                        placeholder="e.g., Benefits of Regular Dental Checkups")
             
-            st.subheader("Quick Options")
-            target_audience = st.selectbox("Target Audience", [
-                "General consumers", "Business owners", "Young professionals",
-                "Families", "Seniors", "Students", "Industry professionals"
-            ])
+            with col2:
+                st.subheader("SEO Keywords")
+                keywords_input = st.text_area("Keywords (one per line)", 
+                    placeholder="dental implants\ncosmetic dentistry\nDenver dentist",
+                    height=100)
+                
+                st.subheader("Quick Options")
+                target_audience = st.selectbox("Target Audience", _TARGET_AUDIENCES)
+                
+                tone = st.selectbox("Tone", _TONES)
             
-            tone = st.selectbox("Tone", [
-                "Professional", "Friendly", "Authoritative", "Conversational"
-            ])
+            # Generate button
+            submitted = st.form_submit_button("🚀 Generate Content", type="primary",
+                                              use_container_width=True)
         
-        # Generate button
-        if st.button("🚀 Generate Content", type="primary", use_container_width=True):
+        if submitted:
             if not business_name or not industry:
                 st.error("Please fill in required fields (marked with *)")
             else:
+                keywords = parse_keywords(keywords_input)
+                
                 # Prepare business info
                 business_info = {
                     'business_name': business_name,
                     'industry': industry,
                     'location': location,
                     'target_audience': target_audience,
+                    'tone': tone,
                     **additional_info
                 }
                 
-                # Generate content
-                with st.spinner("Generating professional content..."):
-                    prompt = create_content_prompt(content_type, business_info, keywords)
-                    content = generator.generate_content(prompt)
-                    
-                    if content:
-                        st.session_state.generated_content = content
-                        st.session_state.content_history.append({
-                            'timestamp': time.strftime("%Y-%m-%d %H:%M:%S"),
-                            'type': content_type,
-                            'business': business_name,
-                            'content': content
-                        })
-                        st.success("Content generated successfully!")
+                # Generate content, rendering tokens as they arrive
+                prompt = create_content_prompt(content_type, business_info, keywords)
+                variants = []
+                model = pick_model(quality)
+                # A near-duplicate answer is only reused when every form input
+                # matches; keywords only need to match as a set, in any order or case
+                scope = "|".join([business_name, content_type, industry, location, target_audience,
+                                  tone, *additional_info.values(), *sorted({k.lower() for k in keywords})])
+                st.write_stream(generator.stream_variants(prompt, variants, model=model,
+                                                          use_cache=not force_regenerate,
+                                                          scope=scope))
+                
+                if variants and variants[0]:
+                    content = variants[0]
+                    show_variants(variants, prompt, model)
+                    record_history(generator.account, content_type, business_name, content)
+                    st.success("Content generated successfully!")
+                    warn_banned_phrases(content)
     
     with tab2:
         st.header("Template Builder")
         st.markdown("*Build your content page structure by selecting sections in order*")
         
         # Initialize template in session state
-        if 'page_template' not in st.session_state:
-            st.session_state.page_template = []
+        st.session_state.setdefault('page_template', [])
         
         col1, col2 = st.columns([1, 1])
         
@@ -342,87 +1362,8 @@ def main():
             st.subheader("📋 Available Content Sections")
             st.markdown("*Click to add sections to your template*")
             
-            # Define content section options with descriptions
-            section_definitions = {
-                "H1": {
-                    "name": "H1 - Main Headline",
-                    "description": "Main page headline (1 only)",
-                    "icon": "🎯"
-                },
-                "Intro": {
-                    "name": "Intro Paragraph",
-                    "description": "1–2-paragraph hook that frames the topic or service",
-                    "icon": "📝"
-                },
-                "Sub-H2": {
-                    "name": "Sub-H2 Header",
-                    "description": "Secondary header to split body content",
-                    "icon": "📑"
-                },
-                "Body-Copy": {
-                    "name": "Body Copy",
-                    "description": "Paragraph(s) under a Sub-H2",
-                    "icon": "📄"
-                },
-                "Bullet-List": {
-                    "name": "Bullet List",
-                    "description": "Benefits, symptoms, checklist, features, etc.",
-                    "icon": "🔸"
-                },
-                "Quote-Testimonial": {
-                    "name": "Quote/Testimonial",
-                    "description": "20-40 words with customer name and title",
-                    "icon": "💬"
-                },
-                "FAQ-Pair": {
-                    "name": "FAQ Pair",
-                    "description": "Question + 2-3-sentence answer",
-                    "icon": "❓"
-                },
-                "CTA": {
-                    "name": "Call to Action",
-                    "description": "1-sentence prompt + button label/URL",
-                    "icon": "🚀"
-                },
-                "Closing": {
-                    "name": "Closing Statement",
-                    "description": "Reassurance/next-step line (often before footer)",
-                    "icon": "✅"
-                },
-                "Service-Overview": {
-                    "name": "Service Overview",
-                    "description": "Detailed explanation of service/product",
-                    "icon": "🛠️"
-                },
-                "Benefits-Section": {
-                    "name": "Benefits Section",
-                    "description": "Key advantages and value propositions",
-                    "icon": "⭐"
-                },
-                "Process-Steps": {
-                    "name": "Process/How It Works",
-                    "description": "Step-by-step process or methodology",
-                    "icon": "🔄"
-                },
-                "Team-Bio": {
-                    "name": "Team/About Section",
-                    "description": "Staff credentials and expertise",
-                    "icon": "👥"
-                },
-                "Pricing-Info": {
-                    "name": "Pricing Information",
-                    "description": "Cost details or consultation info",
-                    "icon": "💰"
-                },
-                "Contact-Info": {
-                    "name": "Contact Information",
-                    "description": "Location, hours, contact details",
-                    "icon": "📞"
-                }
-            }
-            
             # Create buttons for each section type
-            for section_key, section_info in section_definitions.items():
+            for section_key, section_info in _SECTION_DEFINITIONS.items():
                 col_btn1, col_btn2 = st.columns([3, 1])
                 with col_btn1:
                     if st.button(f"{section_info['icon']} {section_info['name']}", 
@@ -439,135 +1380,44 @@ def main():
                                unsafe_allow_html=True)
         
         with col2:
-            st.subheader("🏗️ Your Page Template")
-            
-            if st.session_state.page_template:
-                st.markdown("*Your content will be generated in this order:*")
-                
-                # Display current template
-                for i, section in enumerate(st.session_state.page_template):
-                    col_section, col_up, col_down, col_remove = st.columns([6, 1, 1, 1])
-                    
-                    with col_section:
-                        st.markdown(f"**{i+1}.** {section['icon']} {section['name']}")
-                        st.caption(section['description'])
-                    
-                    with col_up:
-                        if i > 0 and st.button("⬆️", key=f"up_{i}", help="Move up"):
-                            st.session_state.page_template[i], st.session_state.page_template[i-1] = \
-                                st.session_state.page_template[i-1], st.session_state.page_template[i]
-                            st.rerun()
-                    
-                    with col_down:
-                        if i < len(st.session_state.page_template) - 1 and st.button("⬇️", key=f"down_{i}", help="Move down"):
-                            st.session_state.page_template[i], st.session_state.page_template[i+1] = \
-                                st.session_state.page_template[i+1], st.session_state.page_template[i]
-                            st.rerun()
-                    
-                    with col_remove:
-                        if st.button("🗑️", key=f"remove_{i}", help="Remove section"):
-                            st.session_state.page_template.pop(i)
-                            st.rerun()
-                    
-                    st.divider()
-                
-                # Template actions
-                col_clear, col_save = st.columns(2)
-                with col_clear:
-                    if st.button("🗑️ Clear Template", use_container_width=True):
-                        st.session_state.page_template = []
-                        st.rerun()
-                
-                with col_save:
-                    # Could add template saving functionality here
-                    st.markdown("*Template ready for generation*")
-            
-            else:
-                st.info("👆 Click sections from the left to build your page template")
-                
-                # Quick template presets
-                st.subheader("📋 Quick Templates")
-                
-                preset_templates = {
-                    "Standard Service Page": [
-                        {'type': 'H1', 'name': 'H1 - Main Headline', 'description': 'Main page headline', 'icon': '🎯'},
-                        {'type': 'Intro', 'name': 'Intro Paragraph', 'description': 'Hook that frames the service', 'icon': '📝'},
-                        {'type': 'Service-Overview', 'name': 'Service Overview', 'description': 'Detailed service explanation', 'icon': '🛠️'},
-                        {'type': 'Benefits-Section', 'name': 'Benefits Section', 'description': 'Key advantages', 'icon': '⭐'},
-                        {'type': 'Process-Steps', 'name': 'Process/How It Works', 'description': 'Step-by-step process', 'icon': '🔄'},
-                        {'type': 'Quote-Testimonial', 'name': 'Quote/Testimonial', 'description': 'Customer testimonial', 'icon': '💬'},
-                        {'type': 'FAQ-Pair', 'name': 'FAQ Pair', 'description': 'Common questions', 'icon': '❓'},
-                        {'type': 'CTA', 'name': 'Call to Action', 'description': 'Conversion prompt', 'icon': '🚀'},
-                        {'type': 'Closing', 'name': 'Closing Statement', 'description': 'Final reassurance', 'icon': '✅'}
-                    ],
-                    "Simple Landing Page": [
-                        {'type': 'H1', 'name': 'H1 - Main Headline', 'description': 'Main page headline', 'icon': '🎯'},
-                        {'type': 'Intro', 'name': 'Intro Paragraph', 'description': 'Compelling hook', 'icon': '📝'},
-                        {'type': 'Benefits-Section', 'name': 'Benefits Section', 'description': 'Key benefits', 'icon': '⭐'},
-                        {'type': 'Quote-Testimonial', 'name': 'Quote/Testimonial', 'description': 'Social proof', 'icon': '💬'},
-                        {'type': 'CTA', 'name': 'Call to Action', 'description': 'Primary conversion', 'icon': '🚀'}
-                    ],
-                    "Blog Post Structure": [
-                        {'type': 'H1', 'name': 'H1 - Main Headline', 'description': 'Article title', 'icon': '🎯'},
-                        {'type': 'Intro', 'name': 'Intro Paragraph', 'description': 'Article introduction', 'icon': '📝'},
-                        {'type': 'Sub-H2', 'name': 'Sub-H2 Header', 'description': 'Section header', 'icon': '📑'},
-                        {'type': 'Body-Copy', 'name': 'Body Copy', 'description': 'Main content', 'icon': '📄'},
-                        {'type': 'Bullet-List', 'name': 'Bullet List', 'description': 'Key points', 'icon': '🔸'},
-                        {'type': 'Sub-H2', 'name': 'Sub-H2 Header', 'description': 'Another section', 'icon': '📑'},
-                        {'type': 'Body-Copy', 'name': 'Body Copy', 'description': 'More content', 'icon': '📄'},
-                        {'type': 'Closing', 'name': 'Closing Statement', 'description': 'Article conclusion', 'icon': '✅'},
-                        {'type': 'CTA', 'name': 'Call to Action', 'description': 'Reader next step', 'icon': '🚀'}
-                    ]
-                }
-                
-                for template_name, template_structure in preset_templates.items():
-                    if st.button(f"📋 Use {template_name}", key=f"preset_{template_name}"):
-                        st.session_state.page_template = template_structure.copy()
-                        st.rerun()
+            template_editor()
         
         # Business Information and Generation
         if st.session_state.page_template:
             st.header("🏢 Business Information")
             
-            col1, col2 = st.columns(2)
-            
-            with col1:
-                business_name_adv = st.text_input("Business Name*", key="template_business")
-                industry_adv = st.selectbox("Industry*", [
-                    "Healthcare", "Legal", "Real Estate", "Automotive", "Restaurant",
-                    "Fitness", "Beauty/Spa", "Construction", "Technology", "Consulting",
-                    "Education", "Finance", "Retail", "Other"
-                ], key="template_industry")
+            with st.form("template_gen"):
+                col1, col2 = st.columns(2)
                 
-                target_audience_adv = st.selectbox("Target Audience", [
-                    "General consumers", "Business owners", "Young professionals",
-                    "Families", "Seniors", "Students", "Industry professionals"
-                ], key="template_audience")
+                with col1:
+                    business_name_adv = st.text_input("Business Name*", key="template_business")
+                    industry_adv = st.selectbox("Industry*", _INDUSTRIES, key="template_industry")
+                    
+                    target_audience_adv = st.selectbox("Target Audience", _TARGET_AUDIENCES, key="template_audience")
+                    
+                    # Word count
+                    word_count = st.slider("Target Word Count", 200, 3000, 800, step=100, key="template_word_count")
                 
-                # Word count
-                word_count = st.slider("Target Word Count", 200, 3000, 800, step=100, key="template_word_count")
-            
-            with col2:
-                st.subheader("SEO Keywords")
-                primary_keywords = st.text_area("Primary Keywords (one per line)", 
-                    placeholder="Main keywords for this page", height=80, key="template_primary_keywords")
-                secondary_keywords = st.text_area("Secondary Keywords (one per line)", 
-                    placeholder="Supporting keywords", height=80, key="template_secondary_keywords")
+                with col2:
+                    st.subheader("SEO Keywords")
+                    primary_keywords = st.text_area("Primary Keywords (one per line)", 
+                        placeholder="Main keywords for this page", height=80, key="template_primary_keywords")
+                    secondary_keywords = st.text_area("Secondary Keywords (one per line)", 
+                        placeholder="Supporting keywords", height=80, key="template_secondary_keywords")
+                    
+                    custom_requirements = st.text_area("Custom Requirements",
+                        placeholder="Any specific requirements, style preferences, or information to include...",
+                        height=80, key="template_custom_requirements")
                 
-                custom_requirements = st.text_area("Custom Requirements",
-                    placeholder="Any specific requirements, style preferences, or information to include...",
-                    height=80, key="template_custom_requirements")
-        
-            # Template generate button
-            if st.button("🎨 Generate Template Content", type="primary", use_container_width=True):
+                # Template generate button
+                submitted_adv = st.form_submit_button("🎨 Generate Template Content", type="primary",
+                                                      use_container_width=True)
+            
+            if submitted_adv:
                 if not business_name_adv or not industry_adv:
                     st.error("Please fill in business name and industry")
                 else:
-                    all_keywords = []
-                    if primary_keywords:
-                        all_keywords.extend([k.strip() for k in primary_keywords.split('\n') if k.strip()])
-                    if secondary_keywords:
-                        all_keywords.extend([k.strip() for k in secondary_keywords.split('\n') if k.strip()])
+                    all_keywords = parse_keywords(primary_keywords) + parse_keywords(secondary_keywords)
                     
                     business_info = {
                         'business_name': business_name_adv,
@@ -576,36 +1426,164 @@ def main():
                     }
                     
                     with st.spinner("Generating content using your template..."):
-                        # Create template-based prompt
-                        template_prompt = create_template_prompt(
-                            st.session_state.page_template, business_info, 
-                            all_keywords, word_count, custom_requirements
-                        )
-                        content = generator.generate_content(template_prompt, max_tokens=4000)
+                        # One prompt per section, streamed concurrently into
+                        # placeholders kept in page order
+                        template = st.session_state.page_template
+                        prompts = [
+                            create_section_prompt(template, i, business_info,
+                                                  all_keywords, word_count, custom_requirements)
+                            for i in range(len(template))
+                        ]
+                        placeholders = [st.empty() for _ in prompts]
+                        # A section only reuses answers written for the same slot
+                        # of a page built from identical inputs and outline;
+                        # keywords only need to match as a set
+                        page_scope = "|".join([business_name_adv, industry_adv, target_audience_adv,
+                                               str(word_count), custom_requirements,
+                                               *(section['name'] for section in template),
+                                               *sorted({k.lower() for k in all_keywords})])
+                        scopes = [f"{page_scope}|{i}|{section['name']}"
+                                  for i, section in enumerate(template)]
+                        model = pick_model(quality, word_count, auto_tier="Balanced")
+                        sections = generator.generate_sections(prompts, max_tokens=max_tokens_for(word_count, len(prompts)),
+                                                               model=model,
+                                                               use_cache=not force_regenerate,
+                                                               placeholders=placeholders, scopes=scopes)
+                        content = "\n\n".join(s.strip() for s in sections if s)
                         
                         if content:
-                            st.session_state.generated_content = content
-                            st.session_state.content_history.append({
-                                'timestamp': time.strftime("%Y-%m-%d %H:%M:%S"),
-                                'type': 'Template Build',
-                                'business': business_name_adv,
-                                'content': content
-                            })
+                            show_variants([content], model=model)
+                            record_history(generator.account, 'Template Build', business_name_adv, content)
                             st.success("Template content generated successfully!")
+                            warn_banned_phrases(content)
     
     with tab3:
         st.header("Content History")
         
-        if st.session_state.content_history:
-            for i, item in enumerate(reversed(st.session_state.content_history)):
-                with st.expander(f"{item['type']} - {item['business']} ({item['timestamp']})"):
-                    st.write(item['content'])
-                    if st.button(f"Use This Content", key=f"use_{i}"):
-                        st.session_state.generated_content = item['content']
-                        st.success("Content loaded to main editor!")
+        # Only this API key's entries are listed. Only the visible page is read
+        # from the database, and only as previews; full text is fetched for
+        # the selected entry alone
+        history = get_history_store()
+        total = history.count(generator.account, business_q)
+        if total:
+            page_count = math.ceil(total / HISTORY_PAGE_SIZE)
+            page = st.number_input("Page", min_value=1, max_value=page_count, value=1) if page_count > 1 else 1
+            df = pd.DataFrame(history.page(generator.account, (page - 1) * HISTORY_PAGE_SIZE,
+                                           business_q=business_q),
+                              columns=['id', 'timestamp', 'type', 'business', 'content'])
+            event = st.dataframe(df, column_order=['timestamp', 'type', 'business', 'content'],
+                                 use_container_width=True, hide_index=True,
+                                 # A new page, filter or entry shifts the rows, so the
+                                 # selection starts fresh rather than pointing elsewhere
+                                 key=f"history_table_{page}_{business_q}_{total}",
+                                 on_select="rerun", selection_mode="single-row")
+            if event.selection.rows:
+                item = df.iloc[event.selection.rows[0]]
+                content = history.content(generator.account, int(item.id))
+                st.subheader(f"{item.type} - {item.business} ({item.timestamp})")
+                st.write(content)
+                if st.button("Use This Content", key="use_history"):
+                    show_variants([content])
+                    st.success("Content loaded to main editor!")
+            else:
+                st.caption("Select a row to read the full entry.")
+        elif business_q:
+            st.info(f'No history entries match "{business_q}".')
         else:
             st.info("No content generated yet. Use the generation tabs to create content.")
     
+    with tab4:
+        st.header("Batch Jobs")
+        st.markdown("*Queue many pages at once through the OpenAI Batch API - half the cost, results within 24 hours*")
+        
+        uploaded = st.file_uploader("Pages CSV", type="csv",
+            help="Columns: business_name, industry, content_type, keywords (separated by ;). "
+                 "Optional: location, target_audience, service_name, topic")
+        
+        store = get_history_store()
+        rows = []
+        if uploaded and st.button("📦 Queue for Batch", type="primary"):
+            try:
+                rows = list(csv.DictReader(io.StringIO(uploaded.getvalue().decode("utf-8-sig"))))
+            except UnicodeDecodeError:
+                st.error("Couldn't read the CSV as UTF-8. Re-save it as \"CSV UTF-8\" and upload it again.")
+        if rows:
+            prompts, pages, skipped = {}, {}, []
+            for row_num, row in enumerate(rows, start=2):
+                row = {k.strip(): (v or "").strip() for k, v in row.items() if k}
+                keywords = [k for k in map(str.strip, row.pop('keywords', '').split(';')) if k]
+                content_type = row.pop('content_type', '') or "Home Page"
+                try:
+                    prompt = create_content_prompt(content_type, row, keywords)
+                except KeyError as e:
+                    skipped.append(f"Row {row_num}: missing {e}")
+                    continue
+                custom_id = f"row-{row_num}"
+                prompts[custom_id] = prompt
+                pages[custom_id] = {'type': content_type, 'business': row['business_name']}
+            
+            for message in skipped:
+                st.warning(message)
+            
+            if prompts:
+                with st.spinner("Uploading batch..."):
+                    batch_id = generator.submit_batch(prompts, model=pick_model(quality))
+                if batch_id:
+                    store.save_batch_job(generator.account, {
+                        'id': batch_id,
+                        'submitted': time.strftime("%Y-%m-%d %H:%M:%S"),
+                        'status': 'validating',
+                        'pages': pages
+                    })
+                    st.success(f"Queued {len(prompts)} pages as batch {batch_id}")
+        
+        jobs = store.batch_jobs(generator.account)
+        if jobs:
+            st.subheader("Submitted Batches")
+            if 'batch_report' in st.session_state:
+                batch_id, status, collected, failures = st.session_state.pop('batch_report')
+                summary = f"Batch {batch_id} {status}: {collected} pages added to the content history"
+                if failures:
+                    lines = [f"- {row}: {message}" for row, message
+                             in list(failures.items())[:BATCH_FAILURES_SHOWN]]
+                    if len(failures) > BATCH_FAILURES_SHOWN:
+                        lines.append(f"- ...and {len(failures) - BATCH_FAILURES_SHOWN} more")
+                    st.warning(f"{summary}, {len(failures)} failed:\n" + "\n".join(lines))
+                else:
+                    st.success(summary)
+            # One table for all jobs, and a single status button for the selected one
+            df = pd.DataFrame([{'batch': job['id'], 'pages': len(job['pages']),
+                                'submitted': job['submitted'], 'status': job['status']}
+                               for job in jobs])
+            # Newest first, so a new batch shifts every row; keying on the count
+            # clears the selection instead of moving it to another job
+            event = st.dataframe(df, use_container_width=True, hide_index=True,
+                                 key=f"batch_table_{len(jobs)}",
+                                 on_select="rerun", selection_mode="single-row")
+            if event.selection.rows:
+                job = jobs[event.selection.rows[0]]
+                finished = job['status'] == 'collected' or job['status'] in BATCH_TERMINAL_STATUSES
+                if not finished and st.button("🔄 Check Status", key="batch_check"):
+                    result = generator.retrieve_batch(job['id'])
+                    if result['status'] != 'unknown':  # otherwise the error is already shown
+                        # Finished pages go straight into the content history
+                        for custom_id, content in result['results'].items():
+                            page = job['pages'].get(custom_id, {'type': 'Batch', 'business': custom_id})
+                            record_history(generator.account, page['type'], page['business'], content)
+                        # Results are read once, when the batch stops; a failed,
+                        # expired or cancelled batch keeps that status
+                        job['status'] = 'collected' if result['status'] == 'completed' else result['status']
+                        store.save_batch_job(generator.account, job)
+                        if result['status'] in BATCH_TERMINAL_STATUSES:
+                            # Shown after the rerun that refreshes the table
+                            st.session_state.batch_report = (job['id'], job['status'],
+                                                             len(result['results']), result['failures'])
+                        st.rerun()
+            else:
+                st.caption("Select a batch to check its status.")
+        else:
+            st.info("No batch jobs yet. Upload a CSV to queue pages for generation.")
+    
     # Generated Content Display and Editor
     if st.session_state.generated_content:
         st.header("📝 Generated Content")
@@ -615,7 +1593,9 @@ def main():
                                     value=st.session_state.generated_content, 
                                     height=400)
         
-        col1, col2, col3, col4 = st.columns(4)
+        col1, col2, col3 = st.columns(3)
+        # Full-width area below the buttons for streaming regenerated content
+        regenerate_area = st.empty()
         
         with col1:
             if st.button("💾 Save Changes"):
@@ -623,52 +1603,65 @@ def main():
                 st.success("Changes saved!")
         
         with col2:
-            if st.button("📋 Copy to Clipboard"):
-                st.code(edited_content, language=None)
-                st.info("Content ready to copy!")
-        
-        with col3:
             if st.button("🔄 Regenerate"):
-                st.rerun()
+                # Cycle through the variants from the last request and only
+                # call the API again once they are used up
+                next_idx = st.session_state.variant_idx + 1
+                if next_idx < len(st.session_state.variants):
+                    st.session_state.variant_idx = next_idx
+                    st.session_state.generated_content = st.session_state.variants[next_idx]
+                    st.rerun()
+                elif st.session_state.variant_prompt:
+                    # Fresh variants are wanted here, so skip the caches on lookup
+                    variants = []
+                    regenerate_area.write_stream(generator.stream_variants(
+                        st.session_state.variant_prompt, variants,
+                        model=st.session_state.variant_model, use_cache=False))
+                    if variants and variants[0]:
+                        show_variants(variants, st.session_state.variant_prompt,
+                                      st.session_state.variant_model)
+                        st.rerun()
+                else:
+                    st.info("Regenerate template content from the Template Builder tab.")
         
-        with col4:
+        with col3:
             if st.button("🗑️ Clear"):
                 st.session_state.generated_content = ""
                 st.rerun()
         
+        # st.code's built-in copy icon copies in the browser, without a rerun
+        with st.expander("📋 Copy to Clipboard"):
+            st.code(edited_content, language="markdown")
+        
         # Content analysis
         with st.expander("📊 Content Analysis"):
-            words = edited_content.split()
-            word_count_analysis = len(words)
-            char_count = len(edited_content)
-            char_count_no_spaces = len(edited_content.replace(' ', ''))
+            analysis = analyze_content(edited_content, st.session_state.variant_model)
             
             col1, col2, col3 = st.columns(3)
             with col1:
-                st.metric("Word Count", word_count_analysis)
+                st.metric("Word Count", analysis['words'])
             with col2:
-                st.metric("Characters (with spaces)", char_count)
+                st.metric("Characters (with spaces)", analysis['chars'])
             with col3:
-                st.metric("Characters (no spaces)", char_count_no_spaces)
+                st.metric("Characters (no spaces)", analysis['chars_no_spaces'])
             
             # Additional metrics
-            col4, col5, col6 = st.columns(3)
+            col4, col5, col6, col7 = st.columns(4)
             with col4:
-                reading_time = max(1, word_count_analysis // 200)
-                st.metric("Reading Time", f"{reading_time} min")
+                st.metric("Reading Time", f"{analysis['reading_time']} min")
             with col5:
-                if words:
-                    avg_word_length = sum(len(word.strip('.,!?;:"()[]')) for word in words) // len(words)
-                    st.metric("Avg Word Length", f"{avg_word_length} chars")
-                else:
-                    st.metric("Avg Word Length", "0 chars")
+                st.metric("Avg Word Length", f"{analysis['avg_word_length']} chars")
             with col6:
-                sentences = len([s for s in edited_content.split('.') if s.strip()])
-                if sentences > 0:
-                    avg_words_per_sentence = word_count_analysis // sentences
-                    st.metric("Words/Sentence", avg_words_per_sentence)
-                else:
-                    st.metric("Words/Sentence", "0")
+                st.metric("Words/Sentence", analysis['words_per_sentence'])
+            with col7:
+                if analysis['tokens'] is not None:
+                    st.metric("Tokens", analysis['tokens'], help="Counted with the generating model's tokenizer")
+            
+            if analysis['banned_phrases']:
+                st.warning("Generic AI phrases to revise: " +
+                           ", ".join(f'"{p}"' for p in analysis['banned_phrases']))
+            else:
+                st.caption("No generic AI phrases found.")
 
 if __name__ == "__main__":
     main()